@@ -1,10 +1,18 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import io
 import re
 import time
+import pickle
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from datetime import datetime, timedelta, date
-from curl_cffi import requests
-from bs4 import BeautifulSoup
+from curl_cffi.requests import AsyncSession, RequestsError
+from selectolax.lexbor import LexborHTMLParser
 
 # --- PAGE CONFIG ---
 st.set_page_config(
@@ -14,7 +22,7 @@ st.set_page_config(
 )
 
 # --- CSS FOR DARK MODE & CLEAN UI ---
-st.markdown("""
+_CSS = """
     <style>
     /* Force Dark Theme adjustments if system default varies */
     .stApp {
@@ -39,18 +47,26 @@ st.markdown("""
     thead tr th:first-child {display:none}
     tbody th {display:none}
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+@st.cache_resource
+def _inject_css():
+    st.markdown(_CSS, unsafe_allow_html=True)
+
+_inject_css()
 
 # ==========================================
 # 1. PARSING & SCRAPING ENGINE
 # ==========================================
 
+# Scheduled time, then the origin up to the first status keyword (or the end)
+_RE_ROW = re.compile(r'(\d{4})\s*(.*?)(?:\s+(?:Arrived|On time|Expected|Cancel)|\s*\Z)', re.S)
+_RE_ARR = re.compile(r'Arrived at\s+(\d{4})')
+
 def clean_time(t_str):
-    try:
-        if not t_str: return None
-        if not re.fullmatch(r'\d{4}', t_str): return None
-        return int(t_str[:2]) * 60 + int(t_str[2:])
-    except: return None
+    if not t_str or len(t_str) != 4 or not t_str.isdecimal(): return None
+    h, m = divmod(int(t_str), 100)
+    return h * 60 + m
 
 def format_date_ordinal(d):
     """Formats date as '10th Dec'"""
@@ -58,11 +74,60 @@ def format_date_ordinal(d):
     suffix = "th" if 11 <= day <= 13 else {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th")
     return f"{day}{suffix} {d.strftime('%b')}"
 
+@lru_cache(maxsize=1024)
 def normalize_station_name(name):
     """Normalize for matching: 'London Charing Cross' -> 'charingcross'"""
     return name.lower().replace("london", "").replace(" ", "").replace("international", "").strip()
 
-def fetch_detailed_departure(service_url, target_station_name):
+def new_session():
+    """
+    One keep-alive session per batch so every request to realtimetrains reuses
+    the same TLS connections. AsyncSession is bound to the event loop that
+    opens it, so it can't live at module scope across asyncio.run calls.
+    """
+    return AsyncSession(impersonate="chrome110", timeout=10)
+
+class RateLimiter:
+    """
+    Token bucket shared by every request in a batch: at most `rate` requests per
+    second, with bursts of up to `burst`. Waiting happens before a request is
+    sent, so workers don't sit on a semaphore slot sleeping after each one.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.updated = burst, time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+REQUEST_RATE = 10  # requests/second to realtimetrains, boards and detail pages alike
+RETRY_STATUS = (500, 502, 503, 504)
+
+async def get_with_retry(session, url, limiter, retries=3, backoff=0.3):
+    """
+    GET paced by `limiter` that retries transient failures (5xx replies,
+    connection errors and timeouts) up to `retries` times, backing off 0.3s,
+    0.6s, 1.2s.
+    """
+    for attempt in range(retries + 1):
+        try:
+            await limiter.acquire()
+            resp = await session.get(url)
+            if resp.status_code not in RETRY_STATUS or attempt == retries: return resp
+        except RequestsError:
+            if attempt == retries: raise
+        await asyncio.sleep(backoff * 2 ** attempt)
+
+async def fetch_detailed_departure(session, service_url, target_station_name, sem, limiter):
     """
     Fetches detailed schedule to find Planned Dep from the boarding station.
     """
@@ -71,42 +136,125 @@ def fetch_detailed_departure(service_url, target_station_name):
         if "?" not in full_url: full_url += "?detailed=true"
         else: full_url += "&detailed=true"
             
-        resp = requests.get(full_url, impersonate="chrome110", timeout=10)
+        async with sem:
+            resp = await get_with_retry(session, full_url, limiter)
         if resp.status_code != 200: return "?"
         
-        soup = BeautifulSoup(resp.text, 'html.parser')
-        locs = soup.find_all('div', class_='location')
+        tree = LexborHTMLParser(resp.text)
+        first_loc = tree.css_first('div.location')
         
         target_clean = normalize_station_name(target_station_name)
+        seen_locs = set()
         
-        for i, loc in enumerate(locs):
-            name_div = loc.find('div', class_='name')
-            if not name_div: continue
+        # One selector pass over the station names instead of a css_first per stop
+        for name_div in tree.css('div.location div.name'):
+            loc = name_div.parent
+            while 'location' not in (loc.attributes.get('class') or '').split():
+                loc = loc.parent
+            # Only a stop's first name counts, as with loc.css_first('div.name')
+            if loc.mem_id in seen_locs: continue
+            seen_locs.add(loc.mem_id)
             
-            row_name = normalize_station_name(name_div.get_text(strip=True))
+            row_name = normalize_station_name(name_div.text(strip=True))
             
             if target_clean in row_name or row_name in target_clean:
                 # 1. Explicit Departure Block
-                dep_block = loc.find('div', class_='dep')
-                if dep_block:
-                    plan = dep_block.find('div', class_='plan')
-                    if plan: return plan.get_text(strip=True)
+                plan = loc.css_first('div.dep div.plan')
+                if plan: return plan.text(strip=True)
                 
                 # 2. Origin Station (often lacks .dep block)
-                if i == 0:
-                    plans = loc.find_all('div', class_='plan')
-                    if plans: return plans[-1].get_text(strip=True)
+                if loc.mem_id == first_loc.mem_id:
+                    plans = loc.css('div.plan')
+                    if plans: return plans[-1].text(strip=True)
                             
         return "-"
     except: return "?"
 
+async def fetch_departures(pairs, on_progress=None):
+    """
+    Looks up Sched Dep for every (service_url, station) pair concurrently.
+    Results keep pair order; on_progress(done, total) fires as each lookup lands.
+    """
+    sem = asyncio.Semaphore(4)
+    limiter = RateLimiter(REQUEST_RATE)
+    results = [None] * len(pairs)
+
+    async def lookup(i, url, stn):
+        return i, await fetch_detailed_departure(session, url, stn, sem, limiter)
+
+    async with new_session() as session:
+        tasks = [lookup(i, url, stn) for i, (url, stn) in enumerate(pairs)]
+        for done, fut in enumerate(asyncio.as_completed(tasks), 1):
+            i, dep = await fut
+            results[i] = dep
+            if on_progress: on_progress(done, len(pairs))
+    return results
+
+DEPARTURE_TTL_TODAY = 300  # seconds; services on past days never change
+DEPARTURE_CACHE_SIZE = 4096
+
+@st.cache_resource
+def departure_cache():
+    """
+    Process-wide LRU of (service_url, station) -> (sched_dep, expires_at), plus the
+    lock guarding it: st.cache_resource shares it across every session thread.
+    """
+    return OrderedDict(), threading.Lock()
+
+def lookup_departures(services, on_progress=None):
+    """
+    Sched Dep for each (service_url, station, service_date), fetching only what
+    the caches can't answer. departure_cache() holds recent lookups in memory;
+    past days are also kept on disk in scrape_cache(), and today's entries expire
+    after DEPARTURE_TTL_TODAY. Failed fetches ("?") aren't cached.
+    """
+    cache, lock = departure_cache()
+    db, db_lock = scrape_cache()
+    today = pd.Timestamp.today().normalize()
+    now = time.monotonic()
+    results = [None] * len(services)
+    misses = []
+    with lock:
+        for key in [k for k, (_, expires) in cache.items() if expires is not None and expires <= now]:
+            del cache[key]
+        for i, (url, stn, day) in enumerate(services):
+            hit = cache.get((url, stn))
+            if hit:
+                cache.move_to_end((url, stn))
+                results[i] = hit[0]
+            else: misses.append(i)
+
+    with db_lock:
+        for i in misses:
+            url, stn, day = services[i]
+            if day < today:
+                hit = db.execute("SELECT sched_dep FROM departures WHERE url = ? AND station = ?", (url, stn)).fetchone()
+                if hit: results[i] = hit[0]
+
+    to_fetch = [i for i in misses if results[i] is None]
+    if to_fetch:
+        fetched = asyncio.run(fetch_departures([services[i][:2] for i in to_fetch], on_progress))
+        for i, dep in zip(to_fetch, fetched):
+            results[i] = dep
+        with db_lock:
+            db.executemany("INSERT OR REPLACE INTO departures VALUES (?, ?, ?)",
+                           [(*services[i][:2], results[i]) for i in to_fetch if results[i] != "?" and services[i][2] < today])
+            db.commit()
+
+    with lock:
+        for i in misses:
+            url, stn, day = services[i]
+            if results[i] != "?":
+                cache[(url, stn)] = (results[i], None if day < today else now + DEPARTURE_TTL_TODAY)
+                cache.move_to_end((url, stn))
+        while len(cache) > DEPARTURE_CACHE_SIZE:
+            cache.popitem(last=False)
+    return results
+
 def parse_row_text(text):
-    sched_match = re.match(r'^(\d{4})', text)
-    if not sched_match: return None, None, None, None
-    sched_str = sched_match.group(1)
-    
-    clean_text = text[4:].strip() 
-    origin = re.split(r'\s+(Arrived|On time|Expected|Cancel)', clean_text)[0].strip()
+    row_match = _RE_ROW.match(text)
+    if not row_match: return None, None, None, None
+    sched_str, origin = row_match.groups()
 
     act_str = None
     status = "UNKNOWN"
@@ -118,12 +266,19 @@ def parse_row_text(text):
         status = "ON TIME"
         act_str = sched_str
     else:
-        arrival_match = re.search(r'Arrived at\s+(\d{4})', text)
-        if arrival_match:
-            act_str = arrival_match.group(1)
-            status = "LATE/EARLY"
-        else:
-            status = "NO REPORT"
+        # Fast path for the usual "Arrived at 0712"; the regex covers odd whitespace
+        status = "NO REPORT"
+        p = text.find("Arrived at")
+        if p >= 0:
+            cand = text[p + 11:p + 15]
+            if text[p + 10:p + 11] == " " and len(cand) == 4 and cand.isdecimal():
+                act_str = cand
+                status = "LATE/EARLY"
+            else:
+                arrival_match = _RE_ARR.search(text)
+                if arrival_match:
+                    act_str = arrival_match.group(1)
+                    status = "LATE/EARLY"
             
     return origin, sched_str, act_str, status
 
@@ -131,105 +286,181 @@ def parse_row_text(text):
 # 2. LOGIC
 # ==========================================
 
+SERVICE_GROUP = ['dt_obj', 'direction', 'dest_code']
+
 def process_delays(trains_df):
+    """
+    Computes delays for every scraped train in one pass. A cancellation is only
+    covered by a later train in the same (date, direction, terminus) group.
+    """
     if trains_df.empty: return trains_df
-    trains_df = trains_df.sort_values('sched_mins').reset_index(drop=True)
-    results = []
-    
-    for i, row in trains_df.iterrows():
-        delay = 0
-        notes = row['status_raw']
-        
-        if row['direction'] == "To London":
-            from_stn = "Sevenoaks"
-            to_stn = "London Charing Cross" if "CHX" in row['dest_code'] else "London Cannon Street"
-            lookup_station = "Sevenoaks" 
-        else:
-            from_stn = row['origin']
-            to_stn = "Sevenoaks"
-            lookup_station = row['origin']
-
-        if row['status_raw'] == "CANCELLED":
-            next_train = None
-            for j in range(i + 1, len(trains_df)):
-                candidate = trains_df.iloc[j]
-                if candidate['status_raw'] != "CANCELLED":
-                    next_train = candidate
-                    break
-            
-            if next_train is not None and pd.notna(next_train['act_mins']) and next_train['act_mins'] > 0:
-                diff = next_train['act_mins'] - row['sched_mins']
-                if diff < -1000: diff += 1440
-                delay = int(diff)
-                notes = f"Cancelled (Next Arr: {next_train['act_str']})"
-            else:
-                delay = 999 
-                notes = "Cancelled (No replacement)"
-        
-        elif pd.notna(row['act_mins']) and pd.notna(row['sched_mins']):
-            diff = row['act_mins'] - row['sched_mins']
-            if diff < -1000: diff += 1440
-            delay = int(diff)
-            if delay <= 0:
-                notes = "On Time"
-                delay = 0 
-            else:
-                notes = f"{delay}m Late"
-
-        results.append({
-            "dt_obj": row['dt_obj'], "From": from_stn, "To": to_stn,
-            "Sched Dep": "?", "Sched Arr": row['sched_str'],
-            "Actual Arr": row['act_str'] if row['act_str'] else "---",
-            "Delay_Mins": delay, "Status": notes, "url": row['url'],
-            "lookup_station": lookup_station
-        })
-        
-    return pd.DataFrame(results)
+    n = len(trains_df)
+
+    # One argsort over (group, sched_mins) instead of sorting and re-indexing the
+    # frame; every column is then read positionally through `order`
+    group = trains_df.groupby(SERVICE_GROUP, observed=True).ngroup().to_numpy()
+    sched = trains_df['sched_mins'].to_numpy(dtype=float)
+    order = np.lexsort((sched, group))
+    group, sched = group[order], sched[order]
+
+    def column(name):
+        return trains_df[name].to_numpy(dtype=object)[order]
+
+    act = trains_df['act_mins'].to_numpy(dtype=float)[order]
+    act_str = column('act_str')
+    cancelled = (trains_df['status_raw'] == "CANCELLED").to_numpy()[order]
+
+    # Position of the next non-cancelled train after each row (-1 if none):
+    # a reverse running minimum over alive positions, shifted up by one
+    alive_pos = np.where(cancelled, n, np.arange(n))
+    next_alive = np.append(np.minimum.accumulate(alive_pos[::-1])[::-1][1:], n)
+    next_alive[next_alive == n] = -1
+    # Rows are grouped contiguously, so a next train from another group means none in this one
+    has_next = (next_alive >= 0) & (group[next_alive] == group)
+    next_act = np.where(has_next, act[next_alive], np.nan)
+    next_act_str = act_str[next_alive]
+
+    def wrap_midnight(diff):
+        return np.where(diff < -1000, diff + 1440, diff)
+
+    # Cancelled trains are delayed until the next train actually arrives
+    replaced = cancelled & (next_act > 0)
+    cancel_diff = wrap_midnight(next_act - sched)
+    timed = ~cancelled & ~np.isnan(act) & ~np.isnan(sched)
+    run_diff = wrap_midnight(act - sched)
+    late = timed & (run_diff > 0)
+
+    delay = np.select([replaced, cancelled, late], [cancel_diff, 999, run_diff], default=0).astype(int)
+    notes = column('status_raw')
+    notes[timed] = "On Time"
+    notes[late] = np.char.add(delay[late].astype(str), "m Late")
+    notes[cancelled] = "Cancelled (No replacement)"
+    notes[replaced] = np.char.add(np.char.add("Cancelled (Next Arr: ", next_act_str[replaced].astype(str)), ")")
+
+    to_london = (trains_df['direction'] == "To London").to_numpy()[order]
+    to_chx = (trains_df['dest_code'] == "CHX").to_numpy()[order]
+    origin = column('origin')
+    london_term = np.where(to_chx, "London Charing Cross", "London Cannon Street")
+
+    return pd.DataFrame({
+        "dt_obj": trains_df['dt_obj'].to_numpy()[order],
+        "From": np.where(to_london, "Sevenoaks", origin),
+        "To": np.where(to_london, london_term, "Sevenoaks"),
+        "Sched Dep": "?", "Sched Arr": column('sched_str'),
+        "Actual Arr": np.where(pd.isna(act_str), "---", act_str),
+        "Delay_Mins": delay, "Status": notes, "url": column('url'),
+        "lookup_station": np.where(to_london, "Sevenoaks", origin),
+    })
+
+SCRAPE_CACHE_PATH = "delayrepay_cache.db"
+RAW_COLUMNS = ['dt_obj', 'direction', 'origin', 'dest_code', 'sched_str', 'act_str',
+               'sched_mins', 'act_mins', 'status_raw', 'url']
+SCRAPE_TTL_TODAY = 600  # seconds; boards that may still change are refetched after this
+SCRAPE_SETTLE = pd.Timedelta(days=1, hours=2)  # after date + this, a board is final (late runners included)
+
+@st.cache_resource
+def scrape_cache():
+    """
+    On-disk store of parsed arrivals boards and past-day Sched Dep lookups, plus
+    the lock serialising access to it.
+    """
+    db = sqlite3.connect(SCRAPE_CACHE_PATH, check_same_thread=False)
+    # Payloads are pickled lists of RAW_COLUMNS tuples
+    db.execute("""CREATE TABLE IF NOT EXISTS board_rows (
+        date TEXT, hour TEXT, dest_code TEXT, payload BLOB, fetched_at REAL,
+        PRIMARY KEY (date, hour, dest_code))""")
+    db.execute("""CREATE TABLE IF NOT EXISTS departures (
+        url TEXT, station TEXT, sched_dep TEXT, PRIMARY KEY (url, station))""")
+    return db, threading.Lock()
+
+async def scrape_job(session, job, sem, limiter):
+    """
+    Fetches one arrivals board and returns its parsed rows (RAW_COLUMNS tuples)
+    that pass the job's filter, or None if the board couldn't be fetched.
+    """
+    rows = []
+    try:
+        async with sem:
+            resp = await get_with_retry(session, job['url'], limiter)
+        if resp.status_code != 200: return None
+        tree = LexborHTMLParser(resp.text)
+        filters = job['filter']
+        for row in tree.css('a.service'):
+            text = row.text(separator=" ", strip=True)
+            # Origin is part of the row text, so most rows can be dropped before parsing
+            if not any(f in text for f in filters): continue
+            origin, sched, act, status = parse_row_text(text)
+            if sched and any(f in origin for f in filters):
+                rows.append((job['date'], job['dir'], origin, job['dest_code'], sched, act,
+                             clean_time(sched), clean_time(act), status, row.attributes.get('href')))
+    except: return None
+    return rows
+
+async def scrape_jobs(jobs):
+    """Runs every scrape job concurrently; returns each job's rows (or None) in job order."""
+    sem = asyncio.Semaphore(8)
+    limiter = RateLimiter(REQUEST_RATE)
+    async with new_session() as session:
+        return await asyncio.gather(*(scrape_job(session, job, sem, limiter) for job in jobs))
 
-@st.cache_data(show_spinner=False)
+def scrape_boards(jobs):
+    """
+    Rows for every job, in job order. Boards already in scrape_cache() are read
+    from disk: indefinitely if fetched once their day had settled (SCRAPE_SETTLE),
+    otherwise for SCRAPE_TTL_TODAY. Only the rest are fetched, and failed fetches
+    aren't stored.
+    """
+    db, lock = scrape_cache()
+    now = time.time()
+    boards = [None] * len(jobs)
+    misses = []
+    with lock:
+        for i, job in enumerate(jobs):
+            hit = db.execute("SELECT payload, fetched_at FROM board_rows WHERE date = ? AND hour = ? AND dest_code = ?",
+                             job['key']).fetchone()
+            settled_at = time.mktime((job['date'] + SCRAPE_SETTLE).timetuple())
+            if hit and (hit[1] >= settled_at or now - hit[1] < SCRAPE_TTL_TODAY):
+                boards[i] = pickle.loads(hit[0])
+            else: misses.append(i)
+
+    if misses:
+        fetched = asyncio.run(scrape_jobs([jobs[i] for i in misses]))
+        with lock:
+            db.executemany("INSERT OR REPLACE INTO board_rows VALUES (?, ?, ?, ?, ?)",
+                           [(*jobs[i]['key'], pickle.dumps(rows), now) for i, rows in zip(misses, fetched) if rows is not None])
+            db.commit()
+        for i, rows in zip(misses, fetched):
+            boards[i] = rows
+    return [row for rows in boards if rows for row in rows]
+
+@st.cache_data(show_spinner=False, ttl=SCRAPE_TTL_TODAY, max_entries=32)
 def run_full_scrape(date_list, am_hours, pm_hours):
-    all_raw_data = []
-    
+    jobs = []
     for d in date_list:
         date_str = d.strftime("%Y-%m-%d")
-        display_date = d.strftime("%d/%m/%Y")
         
-        jobs = []
         for h in am_hours:
             for term in ["CHX", "CST"]:
                 jobs.append({"url": f"https://www.realtimetrains.co.uk/search/simple/gb-nr:{term}/{date_str}/{h}/arrivals", 
-                             "dir": "To London", "filter": "Sevenoaks", "dest_code": term})
+                             "key": (date_str, h, term), "date": d, "dir": "To London", "filter": ["Sevenoaks"], "dest_code": term})
         for h in pm_hours:
             jobs.append({"url": f"https://www.realtimetrains.co.uk/search/simple/gb-nr:SEV/{date_str}/{h}/arrivals", 
-                         "dir": "To Home", "filter": ["London Charing Cross", "London Cannon Street"], "dest_code": "SEV"})
-
-        for job in jobs:
-            try:
-                resp = requests.get(job['url'], impersonate="chrome110", timeout=10)
-                if resp.status_code == 200:
-                    soup = BeautifulSoup(resp.text, 'html.parser')
-                    for row in soup.find_all('a', class_='service'):
-                        text = row.get_text(" ", strip=True)
-                        origin, sched, act, status = parse_row_text(text)
-                        if sched:
-                            filters = job['filter'] if isinstance(job['filter'], list) else [job['filter']]
-                            if any(f in origin for f in filters):
-                                all_raw_data.append({
-                                    "dt_obj": d, "direction": job['dir'], "origin": origin,
-                                    "dest_code": job['dest_code'], "sched_str": sched, "act_str": act,
-                                    "sched_mins": clean_time(sched), "act_mins": clean_time(act),
-                                    "status_raw": status, "url": row.get('href')
-                                })
-                time.sleep(0.05)
-            except: pass
+                         "key": (date_str, h, "SEV"), "date": d, "dir": "To Home", "filter": ["London Charing Cross", "London Cannon Street"], "dest_code": "SEV"})
+
+    all_raw_data = scrape_boards(jobs)
 
     if not all_raw_data: return pd.DataFrame()
-    raw_df = pd.DataFrame(all_raw_data)
-    final_dfs = []
-    for (d, direct, dest), group in raw_df.groupby(['dt_obj', 'direction', 'dest_code']):
-        final_dfs.append(process_delays(group.copy()))
-    if not final_dfs: return pd.DataFrame()
-    return pd.concat(final_dfs).drop_duplicates(subset=['dt_obj', 'From', 'To', 'Sched Arr']).reset_index(drop=True)
+    raw_df = pd.DataFrame(all_raw_data, columns=RAW_COLUMNS)
+    raw_df['dt_obj'] = pd.to_datetime(raw_df['dt_obj'])
+    # Low-cardinality labels: groupby and == comparisons then run on int8 codes
+    for col in ('status_raw', 'direction', 'dest_code'):
+        raw_df[col] = raw_df[col].astype('category')
+    df = process_delays(raw_df).drop_duplicates(subset=['dt_obj', 'From', 'To', 'Sched Arr']).reset_index(drop=True)
+    # Keep the memoised frame small: a handful of station names and delays under 1000
+    df['Delay_Mins'] = pd.to_numeric(df['Delay_Mins'], downcast='integer')
+    for col in ('From', 'To', 'Status', 'lookup_station'):
+        df[col] = df[col].astype('category')
+    return df
 
 # ==========================================
 # 3. UI LAYOUT
@@ -246,22 +477,16 @@ with st.container():
     with col2:
         weekends = st.checkbox("Exclude Weekends", value=False)
 
-    date_list = []
     if mode == "Last N Days":
         days = st.slider("Lookback Days", 1, 30, 7)
-        curr = date.today()
-        for _ in range(days):
-            if not weekends or curr.weekday() < 5: date_list.append(curr)
-            curr -= timedelta(days=1)
+        all_dates = pd.date_range(end=date.today(), periods=days, freq='D')
     else:
         c1, c2 = st.columns(2)
         start = c1.date_input("Start", date.today() - timedelta(days=7))
         end = c2.date_input("End", date.today())
-        curr = start
-        while curr <= end:
-            if not weekends or curr.weekday() < 5: date_list.append(curr)
-            curr += timedelta(days=1)
-        date_list.sort(reverse=True)
+        all_dates = pd.date_range(start, end, freq='D')
+    if weekends: all_dates = all_dates[all_dates.dayofweek < 5]
+    date_list = all_dates.sort_values(ascending=False).tolist()
 
 # --- HOUR CONTROLS ---
 c1, c2 = st.columns(2)
@@ -287,7 +512,7 @@ if start_btn:
         status_text.caption("Scanning schedules...")
 
     # 1. Main Scrape
-    df = run_full_scrape(date_list, am_hours, pm_hours)
+    df = run_full_scrape(tuple(date_list), tuple(am_hours), tuple(pm_hours))
     pbar.progress(40)
 
     if df.empty:
@@ -295,97 +520,78 @@ if start_btn:
         pbar.progress(100)
     else:
         # 2. Filter Top 5 > 15m
-        delayed = df[df['Delay_Mins'] >= 15].copy()
-        top_delays = []
-        for d in date_list:
-            day_subset = delayed[delayed['dt_obj'] == d]
-            top_delays.append(day_subset.sort_values('Delay_Mins', ascending=False).head(5))
-        
-        target_df = pd.concat(top_delays) if top_delays else pd.DataFrame()
+        delayed = df[df['Delay_Mins'] >= 15]
+        target_df = delayed.sort_values(['dt_obj', 'Delay_Mins'], ascending=False).groupby('dt_obj', sort=False).head(5)
         
         # 3. Enrich Sched Dep
         total_enrich = len(target_df)
         if total_enrich > 0:
             status_text.caption(f"Fetching {total_enrich} details...")
-            for i, idx in enumerate(target_df.index):
-                row = df.loc[idx]
-                df.at[idx, 'Sched Dep'] = fetch_detailed_departure(row['url'], row['lookup_station'])
-                pbar.progress(40 + int((i / total_enrich) * 60))
-                time.sleep(0.1)
+            services = list(zip(target_df['url'], target_df['lookup_station'], target_df['dt_obj']))
+            on_progress = lambda done, total: pbar.progress(40 + int((done / total) * 60))
+            df.loc[target_df.index, 'Sched Dep'] = lookup_departures(services, on_progress)
         
         pbar.progress(100)
         status_text.caption("Done.")
 
         # 4. Prepare Display
-        display_rows = []
-        for d in date_list:
-            fmt_date = format_date_ordinal(d)
-            if not target_df.empty:
-                day_data = df.loc[df.index.isin(target_df[target_df['dt_obj'] == d].index)].copy()
-                if not day_data.empty:
-                    day_data = day_data.sort_values("Delay_Mins", ascending=False)
-                    day_data['Date'] = fmt_date
-                    day_data['is_first'] = False
-                    day_data.iloc[0, day_data.columns.get_loc('is_first')] = True
-                    display_rows.extend(day_data.to_dict('records'))
-                else:
-                    display_rows.append({"Date": fmt_date, "From": "No delays >15mn", "Status": "-", "Delay_Mins": 0, "is_first": True})
-            else:
-                display_rows.append({"Date": fmt_date, "From": "No delays >15mn", "Status": "-", "Delay_Mins": 0, "is_first": True})
-
-        final_df = pd.DataFrame(display_rows)
+        fmt_map = {d: format_date_ordinal(d) for d in date_list}
+        day_data = df.loc[target_df.index].sort_values(['dt_obj', 'Delay_Mins'], ascending=False)
+        seen = set(day_data['dt_obj'])
+        quiet_days = [d for d in date_list if d not in seen]
+        no_delays = pd.DataFrame({"dt_obj": quiet_days, "From": "No delays >15mn", "Status": "-", "Delay_Mins": 0})
+
+        final_df = pd.concat([f for f in (day_data, no_delays) if not f.empty], ignore_index=True)
+        final_df = final_df.sort_values('dt_obj', ascending=False, kind='stable', ignore_index=True)
+        final_df['Date'] = final_df['dt_obj'].map(fmt_map)
+        final_df['is_first'] = ~final_df['dt_obj'].duplicated()
         
         # 5. CSV Download (Includes Sched Dep even if hidden in table)
         if not target_df.empty:
-            csv_data = df.loc[target_df.index].drop(columns=['url', 'lookup_station', 'dt_obj'], errors='ignore').to_csv(index=False)
+            csv_buf = io.BytesIO()
+            df.loc[target_df.index].drop(columns=['url', 'lookup_station', 'dt_obj'], errors='ignore').to_csv(csv_buf, index=False, compression='gzip')
             with col_dl:
-                st.download_button("📥 CSV", csv_data, "delays.csv", "text/csv", use_container_width=True)
+                st.download_button("📥 CSV", csv_buf.getvalue(), "delays.csv.gz", "application/gzip", use_container_width=True)
 
         # 6. Final Table
         # Columns requested: Date, From, To, Sched Arr, Act Arr, Status, Link
         # (Sched Dep kept in CSV but hidden here)
-        final_df['Link'] = final_df['url'].apply(lambda x: f"https://www.realtimetrains.co.uk{x}" if x and len(str(x))>5 else None)
+        urls = final_df['url'].astype('string')
+        final_df['Link'] = urls.where(urls.str.len() > 5).radd("https://www.realtimetrains.co.uk")
         
         cols_to_show = ["Date", "From", "To", "Sched Arr", "Actual Arr", "Status", "Link"]
         
-        def style_df(row):
+        def style_df(frame):
             # Dark Mode Base
             bg = '#1e1e1e'
             color = '#e0e0e0'
-            
-            # Subtle Date Grouping (Alternating very subtle grey)
-            # We use is_first to draw a border
-            border = 'border-top: 1px solid #444;' if row.get('is_first') else 'border-top: 1px solid #2a2a2a;'
-            
             base = f'background-color: {bg}; color: {color}; border-bottom: 1px solid #2a2a2a;'
-            styles = [f'{base} {border}'] * len(row)
-            
+
+            first = frame['is_first'].to_numpy(dtype=bool)
+            mins = frame['Delay_Mins'].to_numpy()
+            cancelled = frame['Status'].astype(str).str.contains("CANCELLED", regex=False).to_numpy()
+            no_delays = frame['From'].astype(str).str.contains("No delays", regex=False).to_numpy() & ~cancelled
+
+            # Subtle Date Grouping: is_first draws a stronger top border
+            cell = (base + ' ' + np.where(first, 'border-top: 1px solid #444;', 'border-top: 1px solid #2a2a2a;')).astype(object)
+            styles = np.repeat(cell[:, None], frame.shape[1], axis=1)
+
             # Hide Date if not first
-            if not row.get('is_first'):
-                styles[0] = f'{base} {border} color: {bg};' 
-            else:
-                styles[0] = f'{base} {border} font-weight: bold; color: #90caf9;' 
+            styles[:, 0] = cell + np.where(first, ' font-weight: bold; color: #90caf9;', f' color: {bg};')
 
             # Status Column Coloring (Index 5 in this view)
-            mins = row['Delay_Mins']
-            stat_c = color
-            
-            if mins >= 60: stat_c = '#ef5350' # Red
-            elif mins >= 30: stat_c = '#ff8a65' # Orange
-            elif mins >= 15: stat_c = '#ffe082' # Gold
-            
-            if "CANCELLED" in str(row['Status']):
-                if mins == 0: stat_c = '#ffe082'
-                styles[5] = f'{base} {border} color: {stat_c}; font-style: italic;'
-            elif "No delays" in str(row['From']):
-                styles[1] = f'{base} {border} color: #757575; font-style: italic;'
-            else:
-                styles[5] = f'{base} {border} color: {stat_c}; font-weight: bold;'
+            stat_c = np.select(
+                [mins >= 60, mins >= 30, mins >= 15, cancelled & (mins == 0)],
+                ['#ef5350', '#ff8a65', '#ffe082', '#ffe082'], # Red, Orange, Gold
+                default=color).astype(object)
+            status_css = cell + ' color: ' + stat_c + np.where(cancelled, '; font-style: italic;', '; font-weight: bold;')
+            styles[:, 5] = np.where(no_delays, styles[:, 5], status_css)
+            styles[:, 1] = np.where(no_delays, cell + ' color: #757575; font-style: italic;', styles[:, 1])
 
-            return styles
+            return pd.DataFrame(styles, index=frame.index, columns=frame.columns)
 
         st.dataframe(
-            final_df[cols_to_show + ['Delay_Mins', 'is_first']].style.apply(style_df, axis=1),
+            final_df[cols_to_show + ['Delay_Mins', 'is_first']].style.apply(style_df, axis=None),
             column_config={
                 "Link": st.column_config.LinkColumn("Link", display_text="View"),
                 "Delay_Mins": None, "is_first": None